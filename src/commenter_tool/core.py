@@ -0,0 +1,1151 @@
+"""
+Core engine of the commenter: talks to Ollama, builds prompts, caches results
+and rewrites source files. The command-line interface lives in main.py.
+"""
+import os
+import asyncio
+import functools
+import subprocess
+import shutil
+import time
+import re
+from pathlib import Path
+import tempfile
+import textwrap
+import json
+import logging
+import hashlib
+import sqlite3
+import math
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+from typing import Dict, Optional, Tuple
+import requests
+
+log = logging.getLogger(__name__)
+
+# --- Ollama HTTP API ---
+# A single keep-alive session is reused for every request so the model stays
+# loaded on the server between files instead of paying CLI startup each time.
+OLLAMA_HOST = os.environ.get('OLLAMA_HOST', 'http://127.0.0.1:11434')
+if not OLLAMA_HOST.startswith(('http://', 'https://')):
+    OLLAMA_HOST = f"http://{OLLAMA_HOST}"
+OLLAMA_KEEP_ALIVE = '30m'
+# Decoding on CPU is bound by how many weight bytes are read per token, so
+# the default is a 4-bit K-quant build rather than a larger quantization.
+DEFAULT_MODEL = 'llama3:8b-instruct-q4_K_M'
+# num_ctx is the largest context window a run may ask for. Each run uses the
+# smallest power of two (from MIN_NUM_CTX) that fits its biggest request;
+# it is fixed for the whole run because Ollama reloads the model whenever
+# num_ctx changes.
+DEFAULT_NUM_CTX = 4096
+MIN_NUM_CTX = 2048
+# Prompt tokens are evaluated num_batch at a time; bigger batches evaluate
+# long files faster, up to what memory allows. Like num_ctx (and num_thread)
+# it is a load-time option, so it is fixed for the whole run.
+# 'commenter tune' tries the candidates in order and keeps the fastest.
+DEFAULT_NUM_BATCH = 2048
+NUM_BATCH_CANDIDATES = (512, 1024, 2048, 4096)
+# A larger batch must be at least this much faster to be worth moving up to.
+TUNE_MIN_GAIN = 1.05
+# Generation is streamed; the timeout bounds a whole request, and num_predict
+# caps runaway outputs for a single comment block.
+GENERATION_TIMEOUT = 300
+DEFAULT_NUM_PREDICT = 1024
+# Optional speculative decoding: a small draft model proposes tokens that the
+# main model verifies. Stock Ollama ignores these options; servers whose
+# error names the draft option are remembered here so the rest of the run
+# goes straight to target-only decoding.
+DEFAULT_NUM_DRAFT = 8
+_REJECTED_DRAFT_MODELS = set()
+SESSION = requests.Session()
+
+# Number of files processed concurrently. Matches the server-side
+# OLLAMA_NUM_PARALLEL setting so every request gets its own slot.
+DEFAULT_NUM_PARALLEL = 4
+
+# An optional small model handles inputs up to this many characters.
+DEFAULT_SMALL_MODEL_MAX_CHARS = 4 * 1024
+
+# Small files are sent several at a time so the shared instructions are only
+# processed once per batch. Set max_files_per_batch to 1 to disable batching.
+DEFAULT_MAX_BATCH_CHARS = 8 * 1024
+DEFAULT_MAX_FILES_PER_BATCH = 4
+
+# Files larger than this are skipped rather than sent to the model.
+DEFAULT_MAX_FILE_BYTES = 200 * 1024
+# How many batches per parallel slot are read ahead of the model requests.
+PREFETCH_BATCHES_PER_SLOT = 2
+
+# Generated, minified and vendored files are skipped without a model call:
+# by file name, by a generated-code marker near the top, or by a very long
+# line among the first few (a sign of minified code).
+DEFAULT_SKIP_PATTERNS = ('*.min.js', '*.pb.go', '*_pb2.py', '*.g.dart', '*.freezed.dart')
+_GENERATED_RE = re.compile(r"@generated|DO NOT EDIT")
+GENERATED_MARKER_WINDOW = 2000
+MINIFIED_LINE_LENGTH = 2000
+MINIFIED_CHECK_LINES = 50
+
+# Files above the chunk threshold, or too big to fit the context window with
+# the prompt prefix, are split at top-level declarations into parts of
+# roughly DEFAULT_SHARD_CHARS (~1500 tokens), each commented by its own
+# request. Parts repeat the last few lines of the previous part.
+DEFAULT_CHUNK_THRESHOLD_CHARS = 16 * 1024
+DEFAULT_SHARD_CHARS = 6000
+MIN_SHARD_CHARS = 1000
+SHARD_OVERLAP_LINES = 3
+_DECLARATION_RE = re.compile(
+    r"(?:async def|def|class|func|fn|pub|public|private|protected|internal|function|export|"
+    r"impl|struct|enum|interface|type|static|abstract|final|void)\b"
+)
+_BATCH_COMMENT_RE = re.compile(r"--- FILE (\d+) COMMENT START ---(.*?)--- FILE \1 COMMENT END ---", re.S)
+# Cached comments not used for this long are dropped when the cache is opened.
+CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+# Optional reuse of comments across near-duplicate files. Code is normalized
+# (comments and whitespace removed) before it is embedded.
+DEFAULT_EMBED_MODEL = 'nomic-embed-text'
+DEFAULT_SEMANTIC_THRESHOLD = 0.97
+_CODE_COMMENT_RE = re.compile(r"/\*.*?\*/|(?://|#).*?$", re.S | re.M)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Directory runs only pick up these file types and never descend into the
+# listed directories.
+SOURCE_EXTENSIONS = frozenset({'py', 'js', 'ts', 'go', 'rs', 'java', 'dart'})
+# Hidden directories (.git, .venv, .tox, .idea, ...) are skipped as well.
+SKIP_DIRS = frozenset({'node_modules', 'venv', '__pycache__', 'dist', 'build'})
+
+# Commented files start with a marker line so later runs skip them without
+# calling the model. It is written as a line comment of the file's language;
+# files with an extension not listed here get no marker, since a guessed
+# comment token could break them.
+COMMENTER_MARKER = '@commenter:v1'
+LINE_COMMENT_TOKENS = {
+    **dict.fromkeys(('py', 'sh', 'bash', 'zsh', 'rb', 'pl', 'r', 'yaml', 'yml', 'toml', 'ps1'), '#'),
+    **dict.fromkeys(('js', 'jsx', 'mjs', 'ts', 'tsx', 'go', 'rs', 'java', 'dart', 'kt', 'swift', 'scala',
+                     'c', 'h', 'cc', 'cpp', 'hpp', 'cs'), '//'),
+    **dict.fromkeys(('sql', 'lua', 'hs'), '--'),
+}
+_MARKER_RE = re.compile(r"(?:#|//|--)\s*@commenter:v\d+\b")
+
+# Run-wide instructions. Nothing file-specific may be interpolated here; see
+# build_prompt_prefix. Line width is not requested from the model since
+# rewrap_comment_block enforces it afterwards.
+PROMPT_PREFIX_TEMPLATE = """As an experienced software engineer, your task is to analyze code
+and generate a comprehensive comment block that explains it.
+
+You have two strict rules:
+1. You MUST use the following comment syntax: {comment_syntax}
+2. The content of the comment block MUST strictly follow the format provided below. Replace @ai- with generate comments
+
+--- CONTENT FORMAT START ---
+{comment_format}
+--- CONTENT FORMAT END ---
+"""
+# Single-file framing around the code; prompt = intro + code + suffix, sent
+# after the prefix as the system message.
+CODE_PROMPT_INTRO = """
+Here is the code to analyze:
+--- CODE START ---
+"""
+SHARD_PROMPT_INTRO = """
+Here is part {part} of {parts} of a larger file (lines {first_line}-{last_line}).
+Describe only the code in this part:
+--- CODE START ---
+"""
+CODE_PROMPT_SUFFIX = """
+--- CODE END ---
+
+Generate ONLY the comment block, following all rules. Do not include
+any other text, explanations, or the original code in your response.
+"""
+# Multi-file framing; prompt = intro + one section per file + suffix.
+BATCH_PROMPT_INTRO = """
+Here are {count} files to analyze. Write a separate comment block for each one.
+"""
+BATCH_PROMPT_SUFFIX = """
+
+For every file N, reply with its comment block wrapped in these markers:
+--- FILE N COMMENT START ---
+(comment block for file N)
+--- FILE N COMMENT END ---
+
+Generate ONLY the marked comment blocks, following all rules. Do not include
+any other text, explanations, or the original code in your response.
+"""
+
+
+@dataclass
+class RunContext:
+    """Settings shared by every file processed in a single run."""
+    prompt_prefix: str
+    model_name: str
+    num_ctx: int = DEFAULT_NUM_CTX
+    num_predict: int = DEFAULT_NUM_PREDICT
+    num_batch: int = DEFAULT_NUM_BATCH
+    num_thread: Optional[int] = None
+    draft_model: Optional[str] = None
+    small_model: Optional[str] = None
+    small_model_max_chars: int = DEFAULT_SMALL_MODEL_MAX_CHARS
+    max_file_bytes: int = DEFAULT_MAX_FILE_BYTES
+    skip_patterns: Tuple[str, ...] = DEFAULT_SKIP_PATTERNS
+    chunk_threshold_chars: int = DEFAULT_CHUNK_THRESHOLD_CHARS
+    shard_chars: int = DEFAULT_SHARD_CHARS
+    max_batch_chars: int = DEFAULT_MAX_BATCH_CHARS
+    max_files_per_batch: int = DEFAULT_MAX_FILES_PER_BATCH
+    cache: Optional[sqlite3.Connection] = None
+    semantic_cache: Optional['SemanticCache'] = None
+    io_executor: Optional[ThreadPoolExecutor] = None
+    model_executor: Optional[ThreadPoolExecutor] = None
+    request_slots: Optional[asyncio.Semaphore] = None
+    # Prompt prefixes for languages with their own templates, keyed by file
+    # extension and built once at start-up; other files use prompt_prefix.
+    language_prefixes: Dict[str, str] = field(default_factory=dict)
+    # Byte sizes from the stat pass in process_files, keyed by path.
+    file_sizes: Dict[str, int] = field(default_factory=dict)
+
+    def prefix_for(self, file_path):
+        """Returns the prompt prefix for a file's language."""
+        return self.language_prefixes.get(language_of(file_path), self.prompt_prefix)
+
+    def runner_options(self):
+        """Returns the load-time Ollama options shared by every request."""
+        options = {'num_batch': self.num_batch}
+        # Left unset, Ollama picks one thread per physical core.
+        if self.num_thread:
+            options['num_thread'] = self.num_thread
+        return options
+
+
+# --- Main Script Logic ---
+def language_of(file_path):
+    """Returns a file's extension without the dot, or '' if it has none."""
+    _, dot, extension = os.path.basename(file_path).rpartition('.')
+    return extension if dot else ''
+
+_CONTENT_RE = re.compile(r'[a-zA-Z0-9]')
+_COMMENT_CHARS = '*#/'
+
+def comment_prefix(line):
+    """
+    Returns a line's indentation and comment prefix (e.g. " * " or "# "):
+    whitespace, then comment characters, then whitespace. Three lstrip calls
+    find it faster than a regex match.
+    """
+    rest = line.lstrip().lstrip(_COMMENT_CHARS).lstrip()
+    return line[:len(line) - len(rest)]
+
+@functools.lru_cache(maxsize=None)
+def get_wrapper(width, prefix):
+    """
+    Returns a shared TextWrapper for the given width and comment prefix.
+    Wrappers are cached rather than re-pointed at a new prefix because
+    rewraps run concurrently on the I/O pool. Words are split on whitespace
+    only, which keeps URLs and hyphenated identifiers intact and uses
+    textwrap's much simpler word-splitting regex.
+    """
+    return textwrap.TextWrapper(
+        width=width,
+        initial_indent=prefix,
+        subsequent_indent=prefix,
+        break_long_words=False,
+        break_on_hyphens=False
+    )
+
+# Function to enforce the 80-character line limit
+def rewrap_comment_block(comment_block: str, width: int = 80) -> str:
+    """
+    Re-wraps a comment block to a specified width, preserving comment prefixes.
+
+    Args:
+        comment_block: The multi-line string representing the comment block.
+        width: The maximum line width.
+
+    Returns:
+        The reformatted comment block as a single string.
+    """
+    lines = comment_block.splitlines()
+    # Models usually respect the width already, so there is nothing to wrap.
+    if max(map(len, lines), default=0) <= width:
+        return "\n".join(lines)
+
+    reformatted_lines = []
+    # Bound once here rather than looked up again for every line.
+    append = reformatted_lines.append
+    content_search = _CONTENT_RE.search
+
+    for line in lines:
+        # Lines without letters or digits (like /** or */) are kept as-is.
+        if len(line) <= width or not content_search(line):
+            append(line)
+            continue
+
+        # Find the indentation and comment prefix (e.g., " * " or "# ")
+        prefix = comment_prefix(line)
+        content = line[len(prefix):]
+
+        # Use textwrap to wrap the content of the line
+        reformatted_lines.extend(get_wrapper(width, prefix).wrap(content))
+
+    return "\n".join(reformatted_lines)
+
+def raise_for_ollama_error(response):
+    """
+    Like raise_for_status, but the error names what Ollama reported in the
+    response body (e.g. "model ... not found, try pulling it first").
+    """
+    if response.ok:
+        return
+    try:
+        message = response.json()['error']
+    except Exception:
+        message = response.reason
+    raise requests.HTTPError(f"{response.status_code} {message}", response=response)
+
+def ollama_generate(prompt, model_name, num_ctx, label, num_predict=DEFAULT_NUM_PREDICT,
+                    stop_marker=None, partial_ok=False, draft_model=None, system=None,
+                    runner_options=None):
+    """
+    Streams a completion from the Ollama HTTP API and returns the generated
+    text, or None if the request failed.
+
+    The run-wide instructions go in system rather than the prompt, so the
+    server sees them as one fixed system message it can keep cached.
+
+    Generation stops early once stop_marker appears in the output. If the
+    overall timeout is hit and partial_ok is set, whatever was generated so
+    far is returned instead of None. If a draft_model is given and the
+    server's error names it, the request is retried without speculative
+    decoding.
+    runner_options holds the run-wide load settings (num_batch, num_thread).
+    """
+    options = dict(runner_options or {}, num_ctx=num_ctx, num_predict=num_predict)
+    use_draft = draft_model and draft_model not in _REJECTED_DRAFT_MODELS
+    if use_draft:
+        options.update({'draft_model': draft_model, 'num_draft': DEFAULT_NUM_DRAFT})
+    payload = {
+        'model': model_name,
+        'prompt': prompt,
+        'system': system,
+        'stream': True,
+        'keep_alive': OLLAMA_KEEP_ALIVE,
+        'options': options,
+    }
+
+    start_time = time.time()
+    pieces = []
+    try:
+        log.info(f"   ▶️  Requesting Ollama for {label}...")
+        with SESSION.post(f"{OLLAMA_HOST}/api/generate", json=payload, stream=True,
+                          timeout=GENERATION_TIMEOUT) as response:
+            raise_for_ollama_error(response)
+            tail = ''
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise RuntimeError(chunk['error'])
+                piece = chunk.get('response', '')
+                pieces.append(piece)
+                if chunk.get('done'):
+                    break
+                if stop_marker:
+                    # Closing the stream here tells the server to stop decoding.
+                    window = tail + piece
+                    if stop_marker in window:
+                        break
+                    tail = window[-(len(stop_marker) - 1):]
+                if time.time() - start_time > GENERATION_TIMEOUT:
+                    raise requests.Timeout()
+
+        duration = time.time() - start_time
+        log.info(f"   ✅ Ollama generation for {label} finished in {duration:.2f} seconds.")
+
+        # MODIFIED: Use .rstrip() to preserve leading whitespace from the AI
+        # while still cleaning the end of the output.
+        return "".join(pieces).rstrip()
+
+    except requests.Timeout:
+        duration = time.time() - start_time
+        log.error(f"   ❌ Error: Ollama request timed out after {duration:.0f} seconds.")
+        if partial_ok and pieces:
+            log.warning(f"   ⚠️ Keeping the partial output generated for {label}.")
+            return "".join(pieces).rstrip()
+        return None
+    except requests.ConnectionError:
+        log.error(f"   ❌ Error: Could not reach the Ollama server at {OLLAMA_HOST}. Is it running?")
+        if shutil.which('ollama'):
+            log.info(f"   ↩️  Falling back to the Ollama CLI for {label}...")
+            return ollama_generate_cli((system or '') + prompt, model_name, label)
+        return None
+    except requests.HTTPError as e:
+        # Only blame the draft model when the server says so; a missing main
+        # model or an out-of-memory error must not be retried this way.
+        if use_draft and not pieces and 'draft' in str(e).lower():
+            log.warning(f"   ⚠️ Ollama rejected draft model '{draft_model}' ({e}). Continuing without it.")
+            _REJECTED_DRAFT_MODELS.add(draft_model)
+            return ollama_generate(prompt, model_name, num_ctx, label, num_predict, stop_marker, partial_ok,
+                                   system=system, runner_options=runner_options)
+        log.error(f"   ❌ Error: Ollama request for {label} failed: {e}")
+        return None
+    except Exception as e:
+        log.error(f"❌ An unexpected error occurred: {e}")
+        return None
+
+def ollama_generate_cli(prompt, model_name, label):
+    """
+    Generates a completion through the 'ollama run' CLI. Only used when the
+    HTTP API cannot be reached, so per-request options are not applied.
+    """
+    start_time = time.time()
+    try:
+        command = ['ollama', 'run', model_name]
+        log.info(f"   ▶️  Executing Ollama for {label}...")
+
+        # The prompt goes through stdin: as an argument, a large file can
+        # exceed the OS limit on command-line length. Output is captured as
+        # raw bytes and decoded once, independent of the locale.
+        result = subprocess.run(command, input=prompt.encode('utf-8'), capture_output=True, check=True,
+                                timeout=GENERATION_TIMEOUT)
+
+        duration = time.time() - start_time
+        log.info(f"   ✅ Ollama generation for {label} finished in {duration:.2f} seconds.")
+        return result.stdout.decode('utf-8', 'replace').rstrip()
+
+    except subprocess.TimeoutExpired:
+        duration = time.time() - start_time
+        log.error(f"   ❌ Error: Ollama command timed out after {duration:.0f} seconds.")
+        return None
+    except subprocess.CalledProcessError as e:
+        log.error(f"   ❌ Error: Ollama command failed: {e.stderr.decode('utf-8', 'replace').strip()}")
+        return None
+    except Exception as e:
+        log.error(f"❌ An unexpected error occurred: {e}")
+        return None
+
+def build_prompt_prefix(comment_format, comment_syntax):
+    """
+    Builds the instruction prefix shared by every prompt in a run.
+
+    Call it once per run. The prefix holds only run-wide text (rules, syntax,
+    format) and is sent as the system message, so every request starts with
+    byte-identical tokens that the server can reuse from its KV cache while
+    the model stays loaded.
+    """
+    return PROMPT_PREFIX_TEMPLATE.format(comment_syntax=comment_syntax, comment_format=comment_format)
+
+def generate_comments(file_content, prompt_prefix, file_path, model_name,
+                      num_ctx=DEFAULT_NUM_CTX, num_predict=DEFAULT_NUM_PREDICT, draft_model=None,
+                      shard=None, runner_options=None):
+    """
+    Calls the Ollama HTTP API to generate comments for the given code.
+
+    When the code is one part of a larger file, shard is a
+    (part, parts, first_line, last_line) tuple describing its position.
+    """
+    label = os.path.basename(file_path)
+    intro = CODE_PROMPT_INTRO
+    if shard:
+        part, parts, first_line, last_line = shard
+        label = f"{label} (part {part}/{parts})"
+        intro = SHARD_PROMPT_INTRO.format(part=part, parts=parts, first_line=first_line, last_line=last_line)
+    prompt = "".join((intro, file_content, CODE_PROMPT_SUFFIX))
+
+    return ollama_generate(prompt, model_name, num_ctx, label, num_predict, draft_model=draft_model,
+                           system=prompt_prefix, runner_options=runner_options)
+
+def generate_comments_batch(files, prompt_prefix, model_name, num_ctx=DEFAULT_NUM_CTX,
+                            num_predict=DEFAULT_NUM_PREDICT, draft_model=None, runner_options=None):
+    """
+    Generates comments for several small files with a single Ollama request.
+
+    Args:
+        files: A list of (file_path, file_content) tuples.
+
+    Returns:
+        A dict mapping each file's index in `files` to its comment block.
+        Files the model did not answer for are missing from the dict.
+    """
+    parts = [BATCH_PROMPT_INTRO.format(count=len(files))]
+    for i, (path, content) in enumerate(files, start=1):
+        if i > 1:
+            parts.append("\n")
+        parts.extend((f"--- FILE {i} START: {os.path.basename(path)} ---\n", content, f"\n--- FILE {i} END ---"))
+    parts.append(BATCH_PROMPT_SUFFIX)
+    prompt = "".join(parts)
+
+    labels = ", ".join(os.path.basename(path) for path, _ in files)
+    # The blocks share the window with the prompt, so the output budget is
+    # what the prompt leaves over, up to num_predict per file. Files whose
+    # block does not fit are retried on their own by the caller.
+    room = num_ctx - estimate_tokens(len(prompt_prefix) + len(prompt), 0)
+    if room <= 0:
+        return {}
+    # Stop as soon as the last block is closed, and keep any completed blocks
+    # if the request times out part-way through.
+    response = ollama_generate(prompt, model_name, num_ctx, labels, min(num_predict * len(files), room),
+                               stop_marker=f"--- FILE {len(files)} COMMENT END ---", partial_ok=True,
+                               draft_model=draft_model, system=prompt_prefix, runner_options=runner_options)
+    if not response:
+        return {}
+
+    comments = {}
+    for match in _BATCH_COMMENT_RE.finditer(response):
+        index = int(match.group(1)) - 1
+        comment = match.group(2).strip('\n').rstrip()
+        if 0 <= index < len(files) and comment:
+            comments[index] = comment
+    return comments
+
+
+def estimate_tokens(prompt_chars, num_predict):
+    """Estimates the tokens a request needs, counting characters / 4 for the prompt."""
+    return prompt_chars // 4 + num_predict
+
+def should_split(ctx, file_path, chars):
+    """
+    Decides whether a file is commented in parts: when it is longer than the
+    chunk threshold, or when it would not fit the context window whole.
+    """
+    if chars > ctx.chunk_threshold_chars:
+        return True
+    return estimate_tokens(len(ctx.prefix_for(file_path)) + chars, ctx.num_predict) > ctx.num_ctx
+
+def shard_chars_for(ctx, file_path):
+    """Returns the part size for a split file, shrunk if a part would not fit the window."""
+    budget = (ctx.num_ctx - ctx.num_predict) * 4 - len(ctx.prefix_for(file_path))
+    return max(MIN_SHARD_CHARS, min(ctx.shard_chars, budget))
+
+def estimate_num_ctx(prompt_chars, num_predict, max_ctx=DEFAULT_NUM_CTX):
+    """
+    Returns the smallest power-of-two context window, at least MIN_NUM_CTX
+    and at most max_ctx, that fits a prompt of prompt_chars characters plus
+    num_predict generated tokens. Tokens are estimated as characters / 4.
+    """
+    needed = estimate_tokens(prompt_chars, num_predict)
+    num_ctx = MIN_NUM_CTX
+    while num_ctx < needed and num_ctx < max_ctx:
+        num_ctx *= 2
+    return min(num_ctx, max_ctx)
+
+def measure_prompt_speed(prompt, model_name, num_ctx, num_batch):
+    """
+    Returns how many prompt tokens per second the server evaluates with the
+    given num_batch, or None if the request failed.
+    """
+    # A fresh first line keeps the server from reusing a cached prefix.
+    payload = {
+        'model': model_name,
+        'prompt': f"{time.time_ns()}\n{prompt}",
+        'stream': False,
+        'keep_alive': OLLAMA_KEEP_ALIVE,
+        'options': {'num_ctx': num_ctx, 'num_batch': num_batch, 'num_predict': 1},
+    }
+    try:
+        response = SESSION.post(f"{OLLAMA_HOST}/api/generate", json=payload, timeout=GENERATION_TIMEOUT)
+        raise_for_ollama_error(response)
+        result = response.json()
+        return result['prompt_eval_count'] / (result['prompt_eval_duration'] / 1e9)
+    except Exception as e:
+        log.error(f"   ❌ Error: Could not measure num_batch {num_batch}: {e}")
+        return None
+
+def tune_num_batch(prompt, model_name, num_ctx):
+    """
+    Tries increasing num_batch values on one prompt and returns the fastest,
+    stopping once a larger batch no longer helps. Returns None if nothing
+    could be measured.
+    """
+    best_batch, best_speed = None, 0.0
+    for num_batch in NUM_BATCH_CANDIDATES:
+        if num_batch > num_ctx:
+            break
+        log.info(f"   ▶️  Measuring num_batch {num_batch}...")
+        speed = measure_prompt_speed(prompt, model_name, num_ctx, num_batch)
+        if speed is None:
+            break
+        log.info(f"   - {speed:.0f} prompt tokens/s")
+        if speed < best_speed * TUNE_MIN_GAIN:
+            break
+        best_batch, best_speed = num_batch, speed
+    return best_batch
+
+def model_for(ctx, content_chars):
+    """Picks the small model for small inputs when one is configured."""
+    if ctx.small_model and content_chars <= ctx.small_model_max_chars:
+        return ctx.small_model
+    return ctx.model_name
+
+def chunk_code(content, max_chars=DEFAULT_SHARD_CHARS, overlap_lines=SHARD_OVERLAP_LINES):
+    """
+    Splits source code into parts of at most roughly max_chars characters.
+
+    Parts break before top-level (unindented) declarations where possible;
+    a single declaration longer than max_chars is split between lines.
+
+    Returns:
+        A list of (first_line, last_line, text) tuples with 1-based line
+        numbers. Each part after the first starts with the last
+        overlap_lines lines of the previous part for context.
+    """
+    lines = content.splitlines(keepends=True)
+
+    # Segments run from one top-level declaration to the next.
+    segments, start = [], 0
+    for i, line in enumerate(lines):
+        if i > start and _DECLARATION_RE.match(line):
+            segments.append((start, i))
+            start = i
+    segments.append((start, len(lines)))
+
+    # Greedily pack segments into parts, splitting oversized segments.
+    parts, part_start, part_size = [], 0, 0
+    for seg_start, seg_end in segments:
+        for i in range(seg_start, seg_end):
+            size = len(lines[i])
+            at_boundary = i == seg_start
+            if part_size and part_size + size > max_chars and (at_boundary or part_size >= max_chars):
+                parts.append((part_start, i))
+                part_start, part_size = i, 0
+            part_size += size
+    parts.append((part_start, len(lines)))
+
+    shards = []
+    for part_start, part_end in parts:
+        first = max(0, part_start - overlap_lines) if shards else part_start
+        shards.append((first + 1, part_end, "".join(lines[first:part_end])))
+    return shards
+
+def matches_skip_pattern(file_path, skip_patterns):
+    """Checks a file name against the configured skip patterns."""
+    name = os.path.basename(file_path)
+    return any(fnmatch(name, pattern) for pattern in skip_patterns)
+
+def uncommentable_reason(content):
+    """
+    Returns why content should not be sent to the model (generated or
+    minified code), or None if it looks like regular source.
+    """
+    if _GENERATED_RE.search(content, 0, GENERATED_MARKER_WINDOW):
+        return "marked as generated"
+    head = content.split('\n', MINIFIED_CHECK_LINES)[:MINIFIED_CHECK_LINES]
+    if any(len(line) > MINIFIED_LINE_LENGTH for line in head):
+        return "looks minified"
+    return None
+
+def read_source(file_path):
+    """Reads a source file as UTF-8 text."""
+    return Path(file_path).read_text(encoding='utf-8')
+
+def write_source(file_path, content):
+    """
+    Writes UTF-8 text back to a source file atomically: the content goes to a
+    temporary file next to it, which then replaces the original. A crash or a
+    full disk mid-write leaves the original file untouched.
+    """
+    # Resolve symlinks so the link's target is replaced, not the link.
+    target = os.path.realpath(file_path)
+    directory, name = os.path.split(target)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        shutil.copymode(target, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def rewrap_and_write(file_path, original_content, new_comments):
+    """Enforces the line limit on a comment block and prepends it to a file."""
+    # MODIFIED: Enforce 80-char limit programmatically
+    log.info("   - Enforcing 80-character line limit...")
+    new_comments = rewrap_comment_block(new_comments, width=80)
+
+    token = LINE_COMMENT_TOKENS.get(language_of(file_path))
+    marker = f"{token} {COMMENTER_MARKER}\n" if token else ""
+    new_content = f"{marker}{new_comments}\n\n{original_content}"
+    write_source(file_path, new_content)
+
+async def to_thread(func, *args, executor=None, **kwargs):
+    """
+    Runs a blocking function in a thread pool. Without an explicit executor,
+    the event loop's default pool is used.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+async def request_model(ctx, func, *args, **kwargs):
+    """
+    Runs a blocking model request once one of the server's parallel slots is
+    free, so split files never exceed the configured concurrency. The run's
+    load settings are passed along as runner_options.
+    """
+    async with ctx.request_slots:
+        return await to_thread(func, *args, executor=ctx.model_executor,
+                               runner_options=ctx.runner_options(), **kwargs)
+
+async def generate_sharded_comments(file_path, original_content, ctx):
+    """Comments a large file part by part and joins the resulting blocks."""
+    shards = chunk_code(original_content, shard_chars_for(ctx, file_path))
+    log.info(f"   ✂️  Splitting {os.path.basename(file_path)} into {len(shards)} parts...")
+    blocks = await asyncio.gather(*(
+        request_model(ctx, functools.partial(
+            generate_comments, text, ctx.prefix_for(file_path), file_path, model_for(ctx, len(text)), ctx.num_ctx,
+            ctx.num_predict, ctx.draft_model, shard=(part, len(shards), first_line, last_line)))
+        for part, (first_line, last_line, text) in enumerate(shards, start=1)
+    ))
+    if not all(blocks):
+        return None
+    return "\n\n".join(blocks)
+
+async def load_source(file_path, ctx, prefetched=None):
+    """
+    Reads a file for processing, returning None if it should be skipped.
+    prefetched is the file's content (or the error raised reading it) when
+    it was already read ahead.
+    """
+    log.info(f"\n📄 Processing file: {file_path}")
+    if prefetched is None:
+        original_content = await to_thread(read_source, file_path, executor=ctx.io_executor)
+    elif isinstance(prefetched, Exception):
+        raise prefetched
+    else:
+        original_content = prefetched
+    if file_path in ctx.file_sizes:
+        log.debug(f"   - File size: {ctx.file_sizes[file_path] / 1024:.2f} KB")
+
+    if not original_content.strip():
+        log.info(f"   ⚪ Skipping empty file {os.path.basename(file_path)}.")
+        return None
+    if _MARKER_RE.match(original_content):
+        log.info(f"   ⏭️  Skipping {os.path.basename(file_path)}: already commented.")
+        return None
+    reason = uncommentable_reason(original_content)
+    if reason:
+        log.info(f"   ⏭️  Skipping {os.path.basename(file_path)}: {reason}.")
+        return None
+    return original_content
+
+async def apply_comments(file_path, original_content, new_comments, ctx):
+    """Prepends a generated comment block to a file."""
+    if new_comments:
+        await to_thread(rewrap_and_write, file_path, original_content, new_comments,
+                        executor=ctx.io_executor)
+        log.info(f"   ✔️ Successfully added comments to {os.path.basename(file_path)}")
+    else:
+        log.warning(f"   ⚠️ Failed to generate comments for {os.path.basename(file_path)}. Skipping.")
+
+async def find_cached_comments(file_path, original_content, ctx):
+    """
+    Looks for a reusable comment block: an exact content match first, then a
+    near-duplicate file if the semantic cache is enabled.
+
+    Returns:
+        A (comments, embedding) tuple. On a miss, comments is None and
+        embedding is the (bucket, vector) pair to store once comments exist.
+    """
+    comments = cache_get(ctx, file_path, original_content)
+    if comments:
+        log.info(f"   ♻️  Reusing cached comments for {os.path.basename(file_path)}.")
+        return comments, None
+    if ctx.semantic_cache is None:
+        return None, None
+
+    normalized = normalize_code(original_content)
+    vector = await to_thread(ctx.semantic_cache.embed, normalized)
+    if vector is None:
+        return None, None
+    bucket = semantic_bucket(file_path, normalized)
+    comments = ctx.semantic_cache.lookup(bucket, vector)
+    if comments:
+        log.info(f"   ♻️  Reusing comments from a near-duplicate file for {os.path.basename(file_path)}.")
+        cache_put(ctx, file_path, original_content, comments)
+        return comments, None
+    return None, (bucket, vector)
+
+def remember_comments(ctx, file_path, original_content, comments, embedding, model_name=None):
+    """Stores newly generated comments in the exact and semantic caches."""
+    cache_put(ctx, file_path, original_content, comments, model_name)
+    if comments and embedding is not None and ctx.semantic_cache is not None:
+        ctx.semantic_cache.add(*embedding, comments)
+
+async def comment_source(file_path, original_content, ctx, embedding=None, cache_checked=False):
+    """Generates comments for already-loaded file content and prepends them."""
+    new_comments = None
+    if not cache_checked:
+        new_comments, embedding = await find_cached_comments(file_path, original_content, ctx)
+    if not new_comments:
+        if should_split(ctx, file_path, len(original_content)):
+            new_comments = await generate_sharded_comments(file_path, original_content, ctx)
+        else:
+            new_comments = await request_model(ctx, generate_comments, original_content, ctx.prefix_for(file_path),
+                                               file_path, model_for(ctx, len(original_content)),
+                                               ctx.num_ctx, ctx.num_predict,
+                                               ctx.draft_model)
+        remember_comments(ctx, file_path, original_content, new_comments, embedding)
+    await apply_comments(file_path, original_content, new_comments, ctx)
+
+async def process_file(file_path, ctx, prefetched=None):
+    """
+    Reads a file, generates comments, and prepends them.
+    """
+    try:
+        original_content = await load_source(file_path, ctx, prefetched)
+        if original_content is None:
+            return
+
+        await comment_source(file_path, original_content, ctx)
+
+    except Exception as e:
+        log.error(f"   ❌ An unexpected error occurred while processing {file_path}: {e}")
+
+async def process_batch(paths, ctx, prefetched=None):
+    """
+    Comments several small files with one request, falling back to
+    single-file requests for any file the model did not answer for.
+    """
+    files, embeddings = [], []
+    for file_path, content in zip(paths, prefetched or [None] * len(paths)):
+        try:
+            original_content = await load_source(file_path, ctx, content)
+            if original_content is None:
+                continue
+            cached_comments, embedding = await find_cached_comments(file_path, original_content, ctx)
+            if cached_comments:
+                await apply_comments(file_path, original_content, cached_comments, ctx)
+            else:
+                files.append((file_path, original_content))
+                embeddings.append(embedding)
+        except Exception as e:
+            log.error(f"   ❌ An unexpected error occurred while processing {file_path}: {e}")
+
+    comments = {}
+    batch_model = model_for(ctx, sum(len(content) for _, content in files))
+    if len(files) > 1:
+        # Batches never mix languages (see plan_batches), so they share a prefix.
+        comments = await request_model(ctx, generate_comments_batch, files, ctx.prefix_for(files[0][0]),
+                                       batch_model, ctx.num_ctx, ctx.num_predict, ctx.draft_model)
+    for index, (file_path, original_content) in enumerate(files):
+        try:
+            if index in comments:
+                remember_comments(ctx, file_path, original_content, comments[index], embeddings[index],
+                                  batch_model)
+                await apply_comments(file_path, original_content, comments[index], ctx)
+            else:
+                if len(files) > 1:
+                    log.info(f"   ↩️  No batched comment for {os.path.basename(file_path)}. Retrying on its own...")
+                await comment_source(file_path, original_content, ctx, embeddings[index], cache_checked=True)
+        except Exception as e:
+            log.error(f"   ❌ An unexpected error occurred while processing {file_path}: {e}")
+
+def plan_batches(paths, sizes, max_batch_chars, max_files_per_batch, group_of=None):
+    """
+    Groups small files into batches that share one prompt. Files larger than
+    max_batch_chars always get a batch of their own, and files for which
+    group_of returns different values never share a batch.
+    """
+    batches = []
+    open_batches = {}
+    for file_path, size in zip(paths, sizes):
+        if max_files_per_batch <= 1 or size > max_batch_chars:
+            batches.append([file_path])
+            continue
+        group = group_of(file_path) if group_of else None
+        current, current_size = open_batches.get(group, ([], 0))
+        if current and (current_size + size > max_batch_chars or len(current) >= max_files_per_batch):
+            batches.append(current)
+            current, current_size = [], 0
+        current.append(file_path)
+        open_batches[group] = (current, current_size + size)
+    batches.extend(current for current, _ in open_batches.values())
+    return batches
+
+def plan_num_ctx(batches, sizes, ctx):
+    """
+    Sizes the context window for a run from its largest planned request,
+    treating file sizes in bytes as character counts. Must run while
+    ctx.num_ctx still holds the configured maximum.
+    """
+    num_ctx = MIN_NUM_CTX
+    for batch in batches:
+        chars = sum(sizes[path] for path in batch)
+        if len(batch) == 1 and should_split(ctx, batch[0], chars):
+            chars = shard_chars_for(ctx, batch[0])
+        prompt_chars = len(ctx.prefix_for(batch[0])) + chars
+        # A batch asks for num_predict per file but gets by with whatever the
+        # window leaves over (see generate_comments_batch); it only has to
+        # fit the prompt plus one file's budget.
+        needed = estimate_tokens(prompt_chars, ctx.num_predict)
+        if needed > ctx.num_ctx:
+            log.warning(f"⚠️ Warning: The request for {', '.join(os.path.basename(path) for path in batch)} "
+                        f"needs about {needed} tokens, more than the "
+                        f"{ctx.num_ctx}-token context window; its prompt may be cut off. "
+                        f"Raise the limit with 'commenter config --num-ctx'.")
+        num_ctx = max(num_ctx, estimate_num_ctx(prompt_chars, ctx.num_predict * len(batch), ctx.num_ctx))
+    return min(num_ctx, ctx.num_ctx)
+
+async def process_files(paths, ctx, num_parallel):
+    """
+    Processes files concurrently, with at most num_parallel requests in
+    flight. A fixed pool of workers pulls batches from a queue, so the
+    server's parallel slots stay busy and decode the requests together
+    (continuous batching) without a task being created for every file.
+
+    The queue is filled by a producer that starts reading each batch's files
+    on the I/O pool as it enqueues it, so reads overlap with the model
+    requests of earlier batches. The queue is bounded, which caps how many
+    files are held in memory ahead of the workers.
+    """
+    ctx.request_slots = asyncio.Semaphore(num_parallel)
+
+    async def produce(queue, batches, num_workers):
+        for batch in batches:
+            reads = asyncio.gather(
+                *(to_thread(read_source, path, executor=ctx.io_executor) for path in batch),
+                return_exceptions=True,
+            )
+            await queue.put((batch, reads))
+        for _ in range(num_workers):
+            await queue.put(None)
+
+    async def worker(queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch, reads = item
+            contents = await reads
+            if len(batch) == 1:
+                await process_file(batch[0], ctx, contents[0])
+            else:
+                await process_batch(batch, ctx, contents)
+
+    # Disk work (stat, read, rewrap and write-back) runs on its own pool so it
+    # overlaps with the model requests instead of queueing behind them. Model
+    # requests get one thread per slot; the event loop's default pool is sized
+    # from the CPU count and would cap a larger OLLAMA_NUM_PARALLEL.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as io_executor, \
+            ThreadPoolExecutor(max_workers=num_parallel) as model_executor:
+        ctx.io_executor = io_executor
+        ctx.model_executor = model_executor
+        # A file that cannot be stat'ed (e.g. a broken symlink) is dropped on
+        # its own instead of failing the whole run.
+        sizes = await asyncio.gather(
+            *(to_thread(os.path.getsize, path, executor=io_executor) for path in paths),
+            return_exceptions=True,
+        )
+        # Huge (usually generated) files blow out the context window and
+        # only end in a timeout, so they are never sent to the model.
+        kept_paths, kept_sizes = [], []
+        for path, size in zip(paths, sizes):
+            if isinstance(size, Exception):
+                log.error(f"\n❌ Could not read {path}: {size}")
+            elif matches_skip_pattern(path, ctx.skip_patterns):
+                log.info(f"\n⏭️  Skipping {path}: matches a skip pattern.")
+            elif size > ctx.max_file_bytes:
+                log.info(f"\n⏭️  Skipping {path}: {size / 1024:.0f} KB exceeds the {ctx.max_file_bytes / 1024:.0f} KB limit.")
+            else:
+                kept_paths.append(path)
+                kept_sizes.append(size)
+        batches = plan_batches(kept_paths, kept_sizes, ctx.max_batch_chars, ctx.max_files_per_batch,
+                               group_of=ctx.prefix_for)
+        ctx.file_sizes = dict(zip(kept_paths, kept_sizes))
+        ctx.num_ctx = plan_num_ctx(batches, ctx.file_sizes, ctx)
+        log.debug(f"Using a context window of {ctx.num_ctx} tokens.")
+        queue = asyncio.Queue(maxsize=PREFETCH_BATCHES_PER_SLOT * num_parallel)
+        num_workers = min(num_parallel, len(batches))
+        tasks = [asyncio.ensure_future(produce(queue, batches, num_workers))]
+        tasks += [asyncio.ensure_future(worker(queue)) for _ in range(num_workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # If one task failed, stop the rest instead of leaving the
+            # producer blocked on a full queue.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+def open_cache(cache_file):
+    """Opens (and if needed creates) the on-disk cache of generated comments."""
+    cache = sqlite3.connect(cache_file)
+    with cache:
+        cache.execute(
+            "CREATE TABLE IF NOT EXISTS comments "
+            "(key TEXT PRIMARY KEY, comment TEXT NOT NULL, ts INTEGER NOT NULL)"
+        )
+        cache.execute("DELETE FROM comments WHERE ts < ?", (int(time.time()) - CACHE_TTL_SECONDS,))
+    return cache
+
+def hash_parts(*parts):
+    """Hashes a sequence of strings into a hex digest."""
+    return hashlib.blake2b(b"\0".join(part.encode('utf-8') for part in parts), digest_size=32).hexdigest()
+
+def cache_key(ctx, file_path, content, model_name=None):
+    """
+    Hashes everything that determines the generated comment for a file.
+    model_name is the model that served the request; it defaults to the one
+    a single-file request for this content would use.
+    """
+    return hash_parts(model_name or model_for(ctx, len(content)), ctx.prefix_for(file_path), content)
+
+def cache_get(ctx, file_path, content):
+    """
+    Returns the cached comment block for this content, or None on a miss.
+    A hit refreshes the entry's timestamp, so comments that keep being reused
+    never expire.
+    """
+    if ctx.cache is None:
+        return None
+    now = int(time.time())
+    # Batched files may have been served by the main model rather than the
+    # model a single-file request would pick, so both keys can hold a hit.
+    for model_name in dict.fromkeys((model_for(ctx, len(content)), ctx.model_name)):
+        key = cache_key(ctx, file_path, content, model_name)
+        row = ctx.cache.execute(
+            "SELECT comment FROM comments WHERE key = ? AND ts >= ?", (key, now - CACHE_TTL_SECONDS)
+        ).fetchone()
+        if row is not None:
+            break
+    else:
+        return None
+    with ctx.cache:
+        ctx.cache.execute("UPDATE comments SET ts = ? WHERE key = ?", (now, key))
+    return row[0]
+
+def cache_put(ctx, file_path, content, comment, model_name=None):
+    """Stores a freshly generated comment block under the model that wrote it."""
+    if ctx.cache is None or not comment:
+        return
+    with ctx.cache:
+        ctx.cache.execute(
+            "INSERT OR REPLACE INTO comments (key, comment, ts) VALUES (?, ?, ?)",
+            (cache_key(ctx, file_path, content, model_name), comment, int(time.time())),
+        )
+
+def normalize_code(content):
+    """Strips comments and collapses whitespace so cosmetic edits embed alike."""
+    return _WHITESPACE_RE.sub(' ', _CODE_COMMENT_RE.sub('', content)).strip()
+
+def semantic_bucket(file_path, normalized_content):
+    """
+    Groups files by extension and rough size so near-duplicate lookups never
+    match across languages or between files of very different lengths.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    return f"{extension}:{len(normalized_content).bit_length()}"
+
+class SemanticCache:
+    """
+    Reuses comments generated for near-duplicate files.
+
+    Embeddings of normalized code are stored next to the exact-match cache
+    and expire after the same TTL. A lookup compares against the stored
+    embeddings in the same bucket and accepts the closest one if its cosine
+    similarity reaches the threshold.
+    """
+
+    def __init__(self, cache, namespace, embed_model=DEFAULT_EMBED_MODEL,
+                 threshold=DEFAULT_SEMANTIC_THRESHOLD):
+        self.cache = cache
+        self.namespace = namespace
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self._buckets = {}
+        now = int(time.time())
+        with cache:
+            cache.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(namespace TEXT NOT NULL, bucket TEXT NOT NULL, embedding BLOB NOT NULL, comment TEXT NOT NULL, "
+                "ts INTEGER NOT NULL)"
+            )
+            columns = [row[1] for row in cache.execute("PRAGMA table_info(embeddings)")]
+            if 'ts' not in columns:
+                # Tables from older versions have no timestamps; start their clock now.
+                cache.execute("ALTER TABLE embeddings ADD COLUMN ts INTEGER NOT NULL DEFAULT 0")
+                cache.execute("UPDATE embeddings SET ts = ?", (now,))
+            cache.execute("DELETE FROM embeddings WHERE ts < ?", (now - CACHE_TTL_SECONDS,))
+
+    def embed(self, normalized_content):
+        """Returns the unit-length embedding of the content, or None on failure."""
+        try:
+            response = SESSION.post(
+                f"{OLLAMA_HOST}/api/embed",
+                json={'model': self.embed_model, 'input': normalized_content, 'keep_alive': OLLAMA_KEEP_ALIVE},
+                timeout=60,
+            )
+            raise_for_ollama_error(response)
+            vector = response.json()['embeddings'][0]
+        except Exception as e:
+            log.warning(f"   ⚠️ Could not embed code with '{self.embed_model}': {e}")
+            return None
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return array('f', (x / norm for x in vector))
+
+    def _entries(self, bucket):
+        if bucket not in self._buckets:
+            rows = self.cache.execute(
+                "SELECT rowid, embedding, comment FROM embeddings WHERE namespace = ? AND bucket = ? AND ts >= ?",
+                (self.namespace, bucket, int(time.time()) - CACHE_TTL_SECONDS),
+            )
+            entries = []
+            for rowid, blob, comment in rows:
+                vector = array('f')
+                vector.frombytes(blob)
+                entries.append((rowid, vector, comment))
+            self._buckets[bucket] = entries
+        return self._buckets[bucket]
+
+    def lookup(self, bucket, vector):
+        """
+        Returns the comment of the most similar stored file, or None.
+        A hit refreshes that entry's timestamp, like the exact cache does.
+        """
+        best_score, best_rowid, best_comment = self.threshold, None, None
+        for rowid, stored, comment in self._entries(bucket):
+            if len(stored) != len(vector):
+                continue
+            score = sum(a * b for a, b in zip(stored, vector))
+            if score >= best_score:
+                best_score, best_rowid, best_comment = score, rowid, comment
+        if best_rowid is not None:
+            with self.cache:
+                self.cache.execute("UPDATE embeddings SET ts = ? WHERE rowid = ?", (int(time.time()), best_rowid))
+        return best_comment
+
+    def add(self, bucket, vector, comment):
+        """Stores the embedding of a file alongside its generated comment."""
+        entries = self._entries(bucket)
+        with self.cache:
+            cursor = self.cache.execute(
+                "INSERT INTO embeddings (namespace, bucket, embedding, comment, ts) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, bucket, vector.tobytes(), comment, int(time.time())),
+            )
+        entries.append((cursor.lastrowid, vector, comment))
+
+def iter_sources(root):
+    """
+    Yields the paths of supported source files under root, skipping hidden,
+    dependency and build directories as well as directories that cannot be
+    read. Directory symlinks are not followed, so a link back up the tree
+    cannot cause an endless walk.
+    """
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError as e:
+            log.warning(f"⚠️ Skipping unreadable directory {directory}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith('.') and entry.name not in SKIP_DIRS:
+                        pending.append(entry.path)
+                else:
+                    _, dot, extension = entry.name.rpartition('.')
+                    if dot and extension in SOURCE_EXTENSIONS:
+                        yield entry.path
@@ -1,140 +1,77 @@
 import sys
 import os
+import asyncio
+import functools
 import subprocess
-import time
-import re
 import importlib.resources
 from pathlib import Path
-import textwrap # Import the textwrap module
 import argparse # For handling command-line arguments and subcommands
 import json
-
-
-# --- Main Script Logic ---
-# Function to enforce the 80-character line limit
-def rewrap_comment_block(comment_block: str, width: int = 80) -> str:
-    """
-    Re-wraps a comment block to a specified width, preserving comment prefixes.
-
-    Args:
-        comment_block: The multi-line string representing the comment block.
-        width: The maximum line width.
-
-    Returns:
-        The reformatted comment block as a single string.
-    """
-    reformatted_lines = []
-
-    # Heuristic to find the content-bearing lines (ignores lines like /** or */)
-    def is_content_line(line):
-        return re.search(r'[a-zA-Z0-9]', line)
-
-    for line in comment_block.splitlines():
-        if len(line) <= width or not is_content_line(line):
-            reformatted_lines.append(line)
-            continue
-
-        # Find the indentation and comment prefix (e.g., " * " or "# ")
-        match = re.match(r'^(\s*[\*#/]*\s*)', line)
-        prefix = match.group(1) if match else ''
-        content = line[len(prefix):]
-
-        # Use textwrap to wrap the content of the line
-        wrapper = textwrap.TextWrapper(
-            width=width,
-            initial_indent=prefix,
-            subsequent_indent=prefix
-        )
-        reformatted_lines.extend(wrapper.wrap(content))
-
-    return "\n".join(reformatted_lines)
-
-def generate_comments(file_content, comment_format, comment_syntax, file_path, model_name):
-    """
-    Calls the Ollama CLI to generate comments for the given code.
-    """
-    prompt = f"""
-    As an experienced software engineer, your task is to analyze the following code 
-    and generate a comprehensive comment block that explains it.
-
-    You have three strict rules:
-    1. You MUST use the following comment syntax: {comment_syntax}
-    2. The content of the comment block MUST strictly follow the format provided below. Replace @ai- with generate comments
-    3. Each line in your response MUST NOT exceed 80 characters in length. Wrap all text 
-       appropriately to adhere to this rule.
-
-    --- CONTENT FORMAT START ---
-    {comment_format}
-    --- CONTENT FORMAT END ---
-
-    Here is the code to analyze:
-    --- CODE START ---
-    {file_content}
-    --- CODE END ---
-
-    Generate ONLY the comment block, following all rules. Do not include 
-    any other text, explanations, or the original code in your response.
-    """
-
-    try:
-        command = ['ollama', 'run', model_name, prompt]
-        print(f"   ▶️  Executing Ollama for {os.path.basename(file_path)}...")
-        start_time = time.time()
-
-        result = subprocess.run(
-            command, capture_output=True, text=True, check=True,
-            timeout=300, encoding='utf-8'
-        )
-
-        duration = time.time() - start_time
-        print(f"   ✅ Ollama generation finished in {duration:.2f} seconds.")
-
-        # MODIFIED: Use .rstrip() to preserve leading whitespace from the AI
-        # while still cleaning the end of the output.
-        return result.stdout.rstrip()
-
-    except subprocess.TimeoutExpired:
-        duration = time.time() - start_time
-        print(f"   ❌ Error: Ollama command timed out after {duration:.0f} seconds.")
-        return None
-    except Exception as e:
-        print(f"❌ An unexpected error occurred: {e}")
-        return None
-
-
-def process_file(file_path, comment_format, comment_syntax, model_name):
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import time
+import ipaddress
+import socket
+from urllib.parse import urlsplit
+
+from commenter_tool.core import (
+    DEFAULT_CHUNK_THRESHOLD_CHARS,
+    DEFAULT_EMBED_MODEL,
+    DEFAULT_MAX_BATCH_CHARS,
+    DEFAULT_MAX_FILE_BYTES,
+    DEFAULT_MAX_FILES_PER_BATCH,
+    DEFAULT_MODEL,
+    DEFAULT_NUM_BATCH,
+    DEFAULT_NUM_CTX,
+    DEFAULT_NUM_PARALLEL,
+    DEFAULT_NUM_PREDICT,
+    DEFAULT_SEMANTIC_THRESHOLD,
+    DEFAULT_SKIP_PATTERNS,
+    DEFAULT_SMALL_MODEL_MAX_CHARS,
+    OLLAMA_HOST,
+    SESSION,
+    RunContext,
+    SemanticCache,
+    build_prompt_prefix,
+    estimate_num_ctx,
+    hash_parts,
+    iter_sources,
+    open_cache,
+    process_files,
+    read_source,
+    tune_num_batch,
+)
+
+# How long to wait for a freshly started 'ollama serve' to answer.
+SERVER_START_TIMEOUT = 15
+# Default templates bundled in the package's data directory.
+TEMPLATE_NAMES = ('format.txt', 'syntax.txt')
+
+# Named explicitly: run as 'python -m', __name__ would be '__main__'.
+log = logging.getLogger('commenter_tool.main')
+
+def setup_logging(verbose=False):
     """
-    Reads a file, generates comments, and prepends them.
+    Sends the tool's messages to stdout through a queue, so concurrent
+    workers hand them off without waiting on terminal writes. The level
+    comes from COMMENTER_LOG (INFO by default), or DEBUG with --verbose.
+    Returns the listener, which must be stopped to flush the queue.
     """
-    print(f"\n📄 Processing file: {file_path}")
-
-    try:
-        file_size_kb = os.path.getsize(file_path) / 1024
-        print(f"   - File size: {file_size_kb:.2f} KB")
-
-        with open(file_path, 'r', encoding='utf-8') as f:
-            original_content = f.read()
-
-        if not original_content.strip():
-            print("   ⚪ Skipping empty file.")
-            return
-
-        new_comments = generate_comments(original_content, comment_format, comment_syntax, file_path, model_name)
-
-        if new_comments:
-            # MODIFIED: Enforce 80-char limit programmatically
-            print("   - Enforcing 80-character line limit...")
-            new_comments = rewrap_comment_block(new_comments, width=80)
-
-            new_content = f"{new_comments}\n\n{original_content}"
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(new_content)
-            print(f"   ✔️ Successfully added comments to {os.path.basename(file_path)}")
-        else:
-            print(f"   ⚠️ Failed to generate comments for {os.path.basename(file_path)}. Skipping.")
-
-    except Exception as e:
-        print(f"   ❌ An unexpected error occurred while processing {file_path}: {e}")
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger('commenter_tool')
+    logger.addHandler(QueueHandler(log_queue))
+    level = 'DEBUG' if verbose else (os.environ.get('COMMENTER_LOG') or 'INFO').upper()
+    valid_level = isinstance(logging.getLevelName(level), int)
+    logger.setLevel(level if valid_level else 'INFO')
+    logger.propagate = False
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    if not valid_level:
+        log.warning(f"⚠️ Unknown COMMENTER_LOG level '{level}'. Using INFO.")
+    return listener
 
 def get_config_path():
     """Returns the path to the user's config directory and ensures it exists."""
@@ -155,7 +92,20 @@ def save_config(config_data):
     config_file = get_config_path() / "config.json"
     with open(config_file, 'w') as f:
         json.dump(config_data, f, indent=2)
-    print(f"✅ Configuration saved to {config_file}")
+    log.info(f"✅ Configuration saved to {config_file}")
+
+def bundled_template(name):
+    """Returns the packaged copy of a default template."""
+    return importlib.resources.files('commenter_tool') / 'data' / name
+
+def setup_user_config():
+    """Copies the default templates into the config directory if they are missing."""
+    config_dir = get_config_path()
+    for name in TEMPLATE_NAMES:
+        user_file = config_dir / name
+        if not user_file.exists():
+            user_file.write_bytes(bundled_template(name).read_bytes())
+            log.info(f"Created default template: {user_file}")
 
 def check_ollama_installed():
     """Checks if the 'ollama' command is available."""
@@ -165,105 +115,348 @@ def check_ollama_installed():
     except (FileNotFoundError, subprocess.CalledProcessError):
         return False
 
+def ollama_server_running():
+    """Checks whether the Ollama HTTP server answers."""
+    try:
+        SESSION.get(f"{OLLAMA_HOST}/api/version", timeout=2).raise_for_status()
+        return True
+    except Exception:
+        return False
+
+def ollama_host_is_local():
+    """Checks whether OLLAMA_HOST names this machine, i.e. a server we could start."""
+    host = urlsplit(OLLAMA_HOST).hostname or 'localhost'
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except OSError:
+        return False
+    for address in addresses:
+        # Strip an IPv6 zone index such as '%eth0'.
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not (ip.is_loopback or ip.is_unspecified):
+            return False
+    return True
+
+def ensure_ollama_server(timeout=SERVER_START_TIMEOUT):
+    """
+    Makes sure the Ollama server is up, starting 'ollama serve' in the
+    background if it isn't. The server is left running afterwards so the
+    model stays loaded between runs. A server on another machine is never
+    started from here.
+    """
+    if ollama_server_running():
+        return True
+    if not ollama_host_is_local():
+        log.warning(f"⚠️ Warning: The Ollama server at {OLLAMA_HOST} is not answering. "
+                    "It is on another machine, so it will not be started from here.")
+        return False
+    if not check_ollama_installed():
+        return False
+    log.info(f"🚀 Starting the Ollama server at {OLLAMA_HOST}...")
+    subprocess.Popen(
+        ['ollama', 'serve'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if ollama_server_running():
+            return True
+        time.sleep(0.5)
+    log.warning(f"⚠️ Warning: The Ollama server did not start within {timeout} seconds.")
+    return False
+
+def list_local_models():
+    """Returns the exact names of the models the Ollama server has downloaded."""
+    response = SESSION.get(f"{OLLAMA_HOST}/api/tags", timeout=10)
+    response.raise_for_status()
+    return {model['name'] for model in response.json().get('models', [])}
+
+def pull_model(model_name):
+    """Runs 'ollama pull', echoing its progress as it arrives."""
+    process = subprocess.Popen(
+        ['ollama', 'pull', model_name],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace'
+    )
+    last_line = None
+    for line in process.stdout:
+        # Progress bars redraw with carriage returns; only echo real changes.
+        line = line.strip()
+        if line and line != last_line:
+            log.info(f"   {line}")
+            last_line = line
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+def full_model_name(model_name):
+    """
+    Returns the tagged name Ollama lists a model under. Untagged names refer
+    to the ':latest' tag, so 'llama3' must not match 'llama3:instruct'.
+    """
+    return model_name if ':' in model_name else f"{model_name}:latest"
+
 def check_and_pull_model(model_name):
     """Checks if a model is downloaded and pulls it if it isn't."""
-    print(f"Checking for Ollama model '{model_name}'...")
+    log.info(f"Checking for Ollama model '{model_name}'...")
     try:
-        result = subprocess.run(['ollama', 'list'], check=True, capture_output=True, text=True)
-        if model_name in result.stdout:
-            print(f"Model '{model_name}' is already downloaded.")
+        if full_model_name(model_name) in list_local_models():
+            log.info(f"Model '{model_name}' is already downloaded.")
             return True
         else:
-            print(f"Model '{model_name}' not found. Attempting to download...")
-            subprocess.run(['ollama', 'pull', model_name], check=True)
-            print(f"✅ Successfully downloaded '{model_name}'.")
+            log.info(f"Model '{model_name}' not found. Attempting to download...")
+            pull_model(model_name)
+            log.info(f"✅ Successfully downloaded '{model_name}'.")
             return True
     except Exception as e:
-        print(f"❌ Error interacting with Ollama: {e}")
+        log.error(f"❌ Error interacting with Ollama: {e}")
+        return False
+
+def ensure_models(model_names):
+    """
+    Pulls any of the given models the server does not have yet. Returns
+    False if one of them is still missing afterwards.
+    """
+    try:
+        local_models = list_local_models()
+    except Exception as e:
+        log.error(f"❌ Error interacting with Ollama: {e}")
         return False
+    return all(
+        check_and_pull_model(name)
+        for name in model_names
+        if name and full_model_name(name) not in local_models
+    )
 
 # --- NEW: Handlers for the 'run' and 'config' commands ---
 
+@functools.lru_cache(maxsize=None)
+def load_template(custom_path, default_name):
+    """
+    Returns the text of a template, preferring the user's custom file, then
+    the editable copy in the config directory, then the copy bundled in the
+    package's data directory. Each template is read at most once per process.
+    """
+    if custom_path and Path(custom_path).exists():
+        return Path(custom_path).read_text(encoding='utf-8')
+    if custom_path:
+        log.warning(f"⚠️ Warning: Custom {Path(default_name).stem} path not found. Using default.")
+    user_file = get_config_path() / default_name
+    if user_file.exists():
+        return user_file.read_text(encoding='utf-8')
+    return bundled_template(default_name).read_text(encoding='utf-8')
+
 def handle_run_command(args):
     """Handles the main logic of running the commenter tool."""
-    print("--- Starting Commenter ---")
+    log.info("--- Starting Commenter ---")
     config = load_config()
-    model_name = config.get('model_name', 'llama3') # Default to 'llama3'
+    model_name = config.get('model_name', DEFAULT_MODEL)
+    num_ctx = config.get('num_ctx', DEFAULT_NUM_CTX)
 
     # --- Fallback Logic for Config Files ---
     # Try to use user-defined paths, but fall back to package defaults if they fail.
+    # Languages with their own templates get their own prefix, built once here
+    # so the processing loop never touches the template files.
     try:
-        format_path = config.get('format_path')
-        if not format_path or not Path(format_path).exists():
-            if format_path: print(f"⚠️ Warning: Custom format path not found. Using default.")
-            format_ref = importlib.resources.files('commenter_tool') / 'data' / 'format.txt'
-            with format_ref.open('r', encoding='utf-8') as f: comment_format = f.read()
-        else:
-            with open(format_path, 'r', encoding='utf-8') as f: comment_format = f.read()
-
-        syntax_path = config.get('syntax_path')
-        if not syntax_path or not Path(syntax_path).exists():
-            if syntax_path: print(f"⚠️ Warning: Custom syntax path not found. Using default.")
-            syntax_ref = importlib.resources.files('commenter_tool') / 'data' / 'syntax.txt'
-            with syntax_ref.open('r', encoding='utf-8') as f: comment_syntax = f.read()
-        else:
-            with open(syntax_path, 'r', encoding='utf-8') as f: comment_syntax = f.read()
+        comment_format = load_template(config.get('format_path'), 'format.txt')
+        comment_syntax = load_template(config.get('syntax_path'), 'syntax.txt')
+        language_prefixes = {
+            language: build_prompt_prefix(
+                load_template(paths.get('format_path', config.get('format_path')), 'format.txt'),
+                load_template(paths.get('syntax_path', config.get('syntax_path')), 'syntax.txt'),
+            )
+            for language, paths in config.get('languages', {}).items()
+        }
     except Exception as e:
-        print(f"❌ Error loading configuration files: {e}")
+        log.error(f"❌ Error loading configuration files: {e}")
+        return
+
+    # Every request goes to one long-lived server; if it cannot be started,
+    # requests fall back to the 'ollama run' CLI, which pulls models itself.
+    # The HTTP API does not, so missing models are pulled up front.
+    if ensure_ollama_server() and not ensure_models((model_name, config.get('small_model'))):
+        log.error("❌ Stopping: a configured model is not available (see above). Pull it with 'ollama pull', or choose another with 'commenter config'.")
         return
 
-    # --- Process Files (existing logic) ---
+    # --- Process Files ---
     target_path = args.path
+    paths = []
     if os.path.isfile(target_path):
-        process_file(target_path, comment_format, comment_syntax, model_name)
+        paths.append(target_path)
     elif os.path.isdir(target_path):
-        print(f"📁 Processing all files in directory: {target_path}")
-        for root, _, files in os.walk(target_path):
-            for file in files:
-                if file.endswith(('.py', '.js', '.ts', '.go', '.rs', '.java', '.dart')):
-                    file_path = os.path.join(root, file)
-                    process_file(file_path, comment_format, comment_syntax, model_name)
-
-    print("\n✨ All done!")
+        log.info(f"📁 Processing all files in directory: {target_path}")
+        paths.extend(iter_sources(target_path))
+
+    ctx = RunContext(
+        prompt_prefix=build_prompt_prefix(comment_format, comment_syntax),
+        model_name=model_name,
+        num_ctx=num_ctx,
+        num_predict=config.get('max_tokens', DEFAULT_NUM_PREDICT),
+        num_batch=config.get('num_batch', DEFAULT_NUM_BATCH),
+        num_thread=config.get('num_thread'),
+        draft_model=config.get('draft_model'),
+        small_model=config.get('small_model'),
+        small_model_max_chars=config.get('small_model_max_chars', DEFAULT_SMALL_MODEL_MAX_CHARS),
+        max_file_bytes=config.get('max_file_kb', DEFAULT_MAX_FILE_BYTES // 1024) * 1024,
+        skip_patterns=tuple(config.get('skip_patterns', DEFAULT_SKIP_PATTERNS)),
+        chunk_threshold_chars=config.get('chunk_threshold_chars', DEFAULT_CHUNK_THRESHOLD_CHARS),
+        max_batch_chars=config.get('max_batch_chars', DEFAULT_MAX_BATCH_CHARS),
+        max_files_per_batch=config.get('max_files_per_batch', DEFAULT_MAX_FILES_PER_BATCH),
+        language_prefixes=language_prefixes,
+        cache=None if args.no_cache else open_cache(get_config_path() / "cache.sqlite"),
+    )
+    if ctx.cache is not None and config.get('semantic_cache'):
+        ctx.semantic_cache = SemanticCache(
+            ctx.cache,
+            namespace=hash_parts(model_name, ctx.prompt_prefix, *sorted(language_prefixes.values())),
+            embed_model=config.get('embed_model', DEFAULT_EMBED_MODEL),
+            threshold=config.get('semantic_threshold', DEFAULT_SEMANTIC_THRESHOLD),
+        )
+    num_parallel = DEFAULT_NUM_PARALLEL
+    if os.environ.get('OLLAMA_NUM_PARALLEL'):
+        try:
+            num_parallel = max(1, int(os.environ['OLLAMA_NUM_PARALLEL']))
+        except ValueError:
+            log.warning(f"⚠️ OLLAMA_NUM_PARALLEL is not a number ('{os.environ['OLLAMA_NUM_PARALLEL']}'). "
+                        f"Using {DEFAULT_NUM_PARALLEL} parallel requests.")
+    try:
+        asyncio.run(process_files(paths, ctx, num_parallel))
+    finally:
+        if ctx.cache is not None:
+            ctx.cache.close()
+
+    log.info("\n✨ All done!")
 # ... folder processing logic ...
 
 def handle_config_command(args):
     """Handles viewing and updating the configuration."""
-    print("--- Commenter Configuration ---")
+    log.info("--- Commenter Configuration ---")
     if not check_ollama_installed():
-        print("❌ Ollama is not installed or not in your system's PATH.")
-        print("Please install it from https://ollama.com/ and try again.")
+        log.error("❌ Ollama is not installed or not in your system's PATH.")
+        log.error("Please install it from https://ollama.com/ and try again.")
         return
     else:
-        print("✅ Ollama installation found.")
+        log.info("✅ Ollama installation found.")
 
+    setup_user_config()
     config = load_config()
 
     # Update config if any arguments were passed
-    if args.model or args.format_path or args.syntax_path:
+    if any(value is not None for name, value in vars(args).items() if name not in ('command', 'func')):
         if args.model:
             if check_and_pull_model(args.model):
                 config['model_name'] = args.model
+        if args.draft_model is not None:
+            if not args.draft_model:
+                config.pop('draft_model', None)
+                log.info("Disabled speculative decoding.")
+            else:
+                # Not pulled: stock Ollama ignores the option, so downloading
+                # the model up front would only cost disk space.
+                config['draft_model'] = args.draft_model
+                log.info(f"Set draft model to: {args.draft_model}")
+                log.info("Note: Stock Ollama ignores draft models; this only has an effect on servers that support speculative decoding.")
+        if args.small_model is not None:
+            if not args.small_model:
+                config.pop('small_model', None)
+                log.info("Disabled the small model.")
+            elif check_and_pull_model(args.small_model):
+                config['small_model'] = args.small_model
+                log.info(f"Set small model to: {args.small_model}")
+        if args.small_model_max_chars:
+            config['small_model_max_chars'] = args.small_model_max_chars
+            log.info(f"Set small model size limit to: {args.small_model_max_chars} characters")
+        if args.num_ctx:
+            config['num_ctx'] = args.num_ctx
+            log.info(f"Set maximum context window (num_ctx) to: {args.num_ctx}")
+        if args.num_batch:
+            config['num_batch'] = args.num_batch
+            log.info(f"Set prompt batch size (num_batch) to: {args.num_batch}")
+        if args.num_thread is not None:
+            if not args.num_thread:
+                config.pop('num_thread', None)
+                log.info("Let Ollama choose the number of threads.")
+            else:
+                config['num_thread'] = args.num_thread
+                log.info(f"Set CPU threads (num_thread) to: {args.num_thread}")
+        if args.max_tokens:
+            config['max_tokens'] = args.max_tokens
+            log.info(f"Set max generated tokens per comment to: {args.max_tokens}")
+        if args.max_file_kb:
+            config['max_file_kb'] = args.max_file_kb
+            log.info(f"Set max file size to: {args.max_file_kb} KB")
+        if args.skip_patterns is not None:
+            config['skip_patterns'] = [pattern.strip() for pattern in args.skip_patterns.split(',') if pattern.strip()]
+            log.info(f"Set skip patterns to: {', '.join(config['skip_patterns']) or '(none)'}")
+        if args.chunk_threshold_chars:
+            config['chunk_threshold_chars'] = args.chunk_threshold_chars
+            log.info(f"Set split threshold for large files to: {args.chunk_threshold_chars} characters")
+        if args.max_files_per_batch:
+            config['max_files_per_batch'] = args.max_files_per_batch
+            log.info(f"Set max files per batch to: {args.max_files_per_batch}")
+        if args.max_batch_chars:
+            config['max_batch_chars'] = args.max_batch_chars
+            log.info(f"Set max batch size to: {args.max_batch_chars} characters")
+        if args.semantic_cache:
+            enabled = args.semantic_cache == 'on'
+            embed_model = config.get('embed_model', DEFAULT_EMBED_MODEL)
+            if not enabled or check_and_pull_model(embed_model):
+                config['semantic_cache'] = enabled
+                log.info(f"Near-duplicate reuse is now {args.semantic_cache}.")
+        if args.semantic_threshold:
+            config['semantic_threshold'] = args.semantic_threshold
+            log.info(f"Set near-duplicate similarity threshold to: {args.semantic_threshold}")
+        # With --language, template paths apply to files with that extension only.
+        templates, scope = config, ""
+        if args.language:
+            language = args.language.lstrip('.').lower()
+            templates = config.setdefault('languages', {}).setdefault(language, {})
+            scope = f" for .{language} files"
         if args.format_path:
             if Path(args.format_path).exists():
-                config['format_path'] = args.format_path
-                print(f"Set format file path to: {args.format_path}")
+                templates['format_path'] = args.format_path
+                log.info(f"Set format file path{scope} to: {args.format_path}")
             else:
-                print(f"⚠️ Warning: Path not found for format file: {args.format_path}")
+                log.warning(f"⚠️ Warning: Path not found for format file: {args.format_path}")
         if args.syntax_path:
             if Path(args.syntax_path).exists():
-                config['syntax_path'] = args.syntax_path
-                print(f"Set syntax file path to: {args.syntax_path}")
+                templates['syntax_path'] = args.syntax_path
+                log.info(f"Set syntax file path{scope} to: {args.syntax_path}")
             else:
-                print(f"⚠️ Warning: Path not found for syntax file: {args.syntax_path}")
+                log.warning(f"⚠️ Warning: Path not found for syntax file: {args.syntax_path}")
         save_config(config)
     else:
         # If no arguments, just display the current config
-        print("\nCurrent configuration:")
+        log.info("\nCurrent configuration:")
         if not config:
-            print("No configuration set. Using defaults.")
+            log.info("No configuration set. Using defaults.")
         else:
-            print(json.dumps(config, indent=2))
+            log.info(json.dumps(config, indent=2))
+
+def handle_tune_command(args):
+    """Measures prompt evaluation speed for several num_batch values and saves the fastest."""
+    log.info("--- Tuning Commenter ---")
+    config = load_config()
+    model_name = config.get('model_name', DEFAULT_MODEL)
+    try:
+        comment_format = load_template(config.get('format_path'), 'format.txt')
+        comment_syntax = load_template(config.get('syntax_path'), 'syntax.txt')
+        code = read_source(args.path)
+    except Exception as e:
+        log.error(f"❌ Error loading files: {e}")
+        return
+
+    if not ensure_ollama_server() or not ensure_models((model_name,)):
+        log.error("❌ The Ollama server or model is not available; nothing was measured.")
+        return
+    prompt = build_prompt_prefix(comment_format, comment_syntax) + code
+    num_ctx = estimate_num_ctx(len(prompt), 1, config.get('num_ctx', DEFAULT_NUM_CTX))
+    log.info(f"Measuring '{model_name}' on {os.path.basename(args.path)} (each size reloads the model)...")
+    num_batch = tune_num_batch(prompt, model_name, num_ctx)
+    if num_batch is None:
+        log.error("❌ Could not measure any batch size; the configuration was not changed.")
+        return
+    config['num_batch'] = num_batch
+    save_config(config)
+    log.info(f"✅ Set prompt batch size (num_batch) to: {num_batch}")
 
 def main():
     parser = argparse.ArgumentParser(description="An AI-powered tool to automatically comment code.")
@@ -272,17 +465,43 @@ def main():
     # --- Parser for the 'run' command ---
     run_parser = subparsers.add_parser('run', help='Run the commenter on a file or folder.')
     run_parser.add_argument('path', type=str, help='Path to the code file or folder to comment on.')
+    run_parser.add_argument('--no-cache', action='store_true', help='Ignore previously generated comments and always ask the model.')
+    run_parser.add_argument('--verbose', action='store_true', help='Print extra details, such as the size of each file.')
     run_parser.set_defaults(func=handle_run_command)
 
     # --- Parser for the 'config' command ---
     config_parser = subparsers.add_parser('config', help='View or set configuration options.')
-    config_parser.add_argument('--model', type=str, help='Set the Ollama model name to use (e.g., "llama3", "phi3:mini").')
+    config_parser.add_argument('--model', type=str, help='Set the Ollama model name to use (e.g., "llama3:8b-instruct-q4_K_M", "phi3:mini").')
     config_parser.add_argument('--format-path', type=str, help='Set the absolute path to your custom format.txt file.')
     config_parser.add_argument('--syntax-path', type=str, help='Set the absolute path to your custom syntax.txt file.')
+    config_parser.add_argument('--language', type=str, help='Apply --format-path and --syntax-path only to files with this extension (e.g., "js").')
+    config_parser.add_argument('--draft-model', type=str, help='Set a draft model for servers that support speculative decoding (e.g., "phi3:mini"); pass "" to disable.')
+    config_parser.add_argument('--small-model', type=str, help='Set a smaller model used for small files (e.g., "phi3:mini"); pass "" to disable.')
+    config_parser.add_argument('--small-model-max-chars', type=int, help='Set the largest input (in characters) sent to the small model.')
+    config_parser.add_argument('--num-ctx', type=int, help='Set the largest context window (in tokens) Ollama may allocate per request.')
+    config_parser.add_argument('--num-batch', type=int, help='Set how many prompt tokens Ollama evaluates at once (num_batch).')
+    config_parser.add_argument('--num-thread', type=int, help='Set the number of CPU threads Ollama uses (num_thread); pass 0 to let Ollama decide.')
+    config_parser.add_argument('--max-tokens', type=int, help='Set the maximum number of tokens generated for one comment block.')
+    config_parser.add_argument('--max-file-kb', type=int, help='Skip source files larger than this many kilobytes.')
+    config_parser.add_argument('--skip-patterns', type=str, help='Set comma-separated file name patterns to skip (e.g., "*.min.js,*.pb.go").')
+    config_parser.add_argument('--chunk-threshold-chars', type=int, help='Split files longer than this many characters into parts commented separately.')
+    config_parser.add_argument('--max-files-per-batch', type=int, help='Set how many small files may share one request (1 disables batching).')
+    config_parser.add_argument('--max-batch-chars', type=int, help='Set the combined size limit for files sharing one request.')
+    config_parser.add_argument('--semantic-cache', choices=['on', 'off'], help='Reuse comments from near-duplicate files (uses the nomic-embed-text model).')
+    config_parser.add_argument('--semantic-threshold', type=float, help='Set the cosine similarity (0-1) a file must reach to reuse a near-duplicate\'s comments.')
     config_parser.set_defaults(func=handle_config_command)
 
+    # --- Parser for the 'tune' command ---
+    tune_parser = subparsers.add_parser('tune', help='Find the fastest prompt batch size for your machine.')
+    tune_parser.add_argument('path', type=str, help='Path to a typical (preferably large) source file to measure with.')
+    tune_parser.set_defaults(func=handle_tune_command)
+
     args = parser.parse_args()
-    args.func(args)
+    listener = setup_logging(getattr(args, 'verbose', False))
+    try:
+        args.func(args)
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
     main()